@@ -7,6 +7,10 @@ import pyodbc
 import math
 import re
 import asyncio
+import time
+import heapq
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 import mysql.connector
 from dotenv import load_dotenv
 
@@ -47,6 +51,20 @@ PALLET_TARE_LB = 50.0
 MAX_TOTAL_H = 65.0
 EPS = 1e-9
 
+# ---------- Scheduler constants ----------
+# Token buckets: (capacity, refill tokens per second)
+USER_BUCKET = (5, 1 / 6)  # burst of 5, then 10 commands/minute per user
+COMMAND_BUCKETS = {
+    "flag2": (10, 0.5),
+    "order": (10, 0.5),
+    "dim": (30, 2.0),
+}
+# Lower number = served first when a backend is saturated
+COMMAND_PRIORITY = {"flag2": 0, "order": 1}
+# Max concurrent blocking calls per backend
+BACKEND_LIMITS = {"mssql": 4, "mysql": 4}
+SLOW_QUEUE_WAIT_SEC = 1.0
+
 # ---------- Queries ----------
 FLAG2_SQL = """
 SELECT COUNT(*) 
@@ -476,6 +494,126 @@ def get_freight_class(density: float) -> str:
     else:
         return "400"
 
+# ---------- Command scheduler ----------
+_user_buckets = {}
+_command_buckets = {}
+_waiter_seq = itertools.count()
+
+BACKENDS = {
+    name: {
+        "limit": limit,
+        "active": 0,
+        "waiters": [],
+        "executor": ThreadPoolExecutor(max_workers=limit, thread_name_prefix=f"orderbot-{name}"),
+    }
+    for name, limit in BACKEND_LIMITS.items()
+}
+
+SCHED_STATS = {
+    name: {"calls": 0, "limited": 0, "wait_total": 0.0, "wait_max": 0.0}
+    for name in COMMAND_BUCKETS
+}
+
+def _refill(buckets: dict, key, capacity: float, rate: float, now: float) -> dict:
+    bucket = buckets.get(key)
+    if bucket is None:
+        bucket = {"tokens": float(capacity), "updated": now}
+        buckets[key] = bucket
+    else:
+        bucket["tokens"] = min(capacity, bucket["tokens"] + (now - bucket["updated"]) * rate)
+        bucket["updated"] = now
+    return bucket
+
+def take_rate_token(command: str, user_id: int) -> float:
+    """Consume one token from the user and command buckets.
+
+    Returns 0 if the command may run, otherwise seconds until it may retry.
+    """
+    now = time.monotonic()
+    u_cap, u_rate = USER_BUCKET
+    c_cap, c_rate = COMMAND_BUCKETS[command]
+    user_b = _refill(_user_buckets, user_id, u_cap, u_rate, now)
+    cmd_b = _refill(_command_buckets, command, c_cap, c_rate, now)
+
+    retry_after = 0.0
+    if user_b["tokens"] < 1:
+        retry_after = max(retry_after, (1 - user_b["tokens"]) / u_rate)
+    if cmd_b["tokens"] < 1:
+        retry_after = max(retry_after, (1 - cmd_b["tokens"]) / c_rate)
+    if retry_after > 0:
+        SCHED_STATS[command]["limited"] += 1
+        return retry_after
+
+    user_b["tokens"] -= 1
+    cmd_b["tokens"] -= 1
+    return 0.0
+
+async def reject_if_rate_limited(interaction: discord.Interaction, command: str) -> bool:
+    retry_after = take_rate_token(command, interaction.user.id)
+    if retry_after <= 0:
+        return False
+    await interaction.response.send_message(
+        f"⏳ Slow down — try `/orderbot {command}` again in {math.ceil(retry_after)}s.",
+        ephemeral=True,
+    )
+    logging.info(f"/orderbot {command} rate-limited for user {interaction.user.id} ({retry_after:.1f}s)")
+    return True
+
+async def _acquire_slot(backend: str, priority: int):
+    b = BACKENDS[backend]
+    if b["active"] < b["limit"] and not b["waiters"]:
+        b["active"] += 1
+        return
+    fut = asyncio.get_running_loop().create_future()
+    heapq.heappush(b["waiters"], (priority, next(_waiter_seq), fut))
+    try:
+        await fut
+    except asyncio.CancelledError:
+        # Slot may have been handed over just before cancellation
+        if fut.done() and not fut.cancelled():
+            _release_slot(backend)
+        raise
+
+def _release_slot(backend: str):
+    b = BACKENDS[backend]
+    while b["waiters"]:
+        _, _, fut = heapq.heappop(b["waiters"])
+        if not fut.done():
+            fut.set_result(None)  # hand the slot straight to the next waiter
+            return
+    b["active"] -= 1
+
+async def run_db(command: str, backend: str, func, *args):
+    """Run a blocking DB helper on its backend's pool, by command priority."""
+    start = time.monotonic()
+    await _acquire_slot(backend, COMMAND_PRIORITY[command])
+    waited = time.monotonic() - start
+
+    stats = SCHED_STATS[command]
+    stats["calls"] += 1
+    stats["wait_total"] += waited
+    stats["wait_max"] = max(stats["wait_max"], waited)
+    if waited >= SLOW_QUEUE_WAIT_SEC:
+        logging.warning(f"/orderbot {command} waited {waited:.2f}s for {backend}")
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(BACKENDS[backend]["executor"], func, *args)
+    finally:
+        _release_slot(backend)
+
+def format_sched_stats() -> str:
+    lines = ["📊 **Scheduler stats**"]
+    for name, s in SCHED_STATS.items():
+        avg_ms = (s["wait_total"] / s["calls"] * 1000) if s["calls"] else 0.0
+        lines.append(
+            f"`{name}` — DB calls: {s['calls']} • Rate-limited: {s['limited']} • "
+            f"Queue wait avg: {avg_ms:.0f} ms • max: {s['wait_max'] * 1000:.0f} ms"
+        )
+    for name, b in BACKENDS.items():
+        lines.append(f"`{name}` — Active: {b['active']}/{b['limit']} • Queued: {len(b['waiters'])}")
+    return "\n".join(lines)
+
 # ---------- Bot setup ----------
 intents = discord.Intents.default()
 client = commands.Bot(command_prefix="!", intents=intents)
@@ -488,11 +626,13 @@ orderbot_group = app_commands.Group(name="orderbot", description="Order tools")
     description="Get Flag 2 order count (last 2 days) + last Magento status-change time"
 )
 async def orderbot_flag2(interaction: discord.Interaction):
+    if await reject_if_rate_limited(interaction, "flag2"):
+        return
     try:
         await interaction.response.defer()
 
-        count = await asyncio.to_thread(get_flag2_count)
-        inc_id, last_dt, log_line = await asyncio.to_thread(get_last_status_change_global)
+        count = await run_db("flag2", "mssql", get_flag2_count)
+        inc_id, last_dt, log_line = await run_db("flag2", "mysql", get_last_status_change_global)
 
         lines = [f"🧾 Flag 2 count: **{count}**"]
 
@@ -514,10 +654,12 @@ async def orderbot_flag2(interaction: discord.Interaction):
 @orderbot_group.command(name="order", description="Get POS summary plus true Magento items")
 @app_commands.describe(number="Magento order # (e.g., 1000XXXX) or internal order_id / ABW-linked number")
 async def orderbot_order(interaction: discord.Interaction, number: str):
+    if await reject_if_rate_limited(interaction, "order"):
+        return
     try:
         await interaction.response.defer()
 
-        pos_summary = await asyncio.to_thread(get_order_summary, number)
+        pos_summary = await run_db("order", "mssql", get_order_summary, number)
 
         token = number.strip().lstrip("#")
         magento_increment_id = token
@@ -527,8 +669,8 @@ async def orderbot_order(interaction: discord.Interaction, number: str):
             except Exception:
                 magento_increment_id = token
 
-        true_increment_id, true_ship_via, true_items = await asyncio.to_thread(
-            get_true_order_items, magento_increment_id
+        true_increment_id, true_ship_via, true_items = await run_db(
+            "order", "mysql", get_true_order_items, magento_increment_id
         )
 
         if not true_increment_id:
@@ -552,6 +694,9 @@ async def orderbot_order(interaction: discord.Interaction, number: str):
     orientation='Which dimension points up when stacking? Enter L, W, or H. Leave blank for auto.'
 )
 async def orderbot_dim(interaction: discord.Interaction, size: str, boxes: int, weight: float, orientation: str = None):
+    # Pure in-process work: rate-limited, but never queued behind DB-bound commands
+    if await reject_if_rate_limited(interaction, "dim"):
+        return
     try:
         await interaction.response.defer()
 
@@ -652,6 +797,11 @@ async def orderbot_dim(interaction: discord.Interaction, size: str, boxes: int,
         logging.error(f"Error in /orderbot dim: {e}")
         await interaction.followup.send("⚠️ Error computing palletization.")
 
+@orderbot_group.command(name="stats", description="Show rate-limit and queue-wait stats")
+async def orderbot_stats(interaction: discord.Interaction):
+    await interaction.response.send_message(format_sched_stats(), ephemeral=True)
+    logging.info("Handled /orderbot stats.")
+
 # Register the group on the guild
 tree.add_command(orderbot_group, guild=GUILD_ID)
 